@@ -9,12 +9,16 @@
 4. 将添加水印后的照片保存到 mask 文件夹内
 """
 
+import contextlib
+import functools
+import io
 import os
+import re
 import sys
-from PIL import Image, ImageDraw, ImageFont
-from PIL.ExifTags import TAGS
+from PIL import Image, ImageDraw, ImageFont, ImageOps, JpegImagePlugin
 from datetime import datetime
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # 尝试导入HEIC支持
 try:
@@ -23,69 +27,98 @@ try:
     # 注册HEIF/HEIC格式支持
     pillow_heif.register_heif_opener()
 except ImportError:
+    # 不在导入时提示：spawn 方式启动的每个工作进程都会重新导入本模块，
+    # 提示信息统一由 process_folder 在主进程中输出
     HEIC_SUPPORTED = False
-    print("警告: 未安装pillow-heif库，无法处理HEIC格式图片。请运行: pip install pillow-heif")
 
-def get_photo_taken_time(image_path):
+# 常见系统字体（按平台区分，避免探测当前系统上不存在的字体）
+if sys.platform.startswith('win'):
+    SYSTEM_FONTS = [
+        "arial.ttf",
+        "times.ttf",
+        "calibri.ttf",
+        "verdana.ttf",
+        "tahoma.ttf"
+    ]
+elif sys.platform == 'darwin':
+    SYSTEM_FONTS = [
+        "/Library/Fonts/Arial.ttf",
+        "/System/Library/Fonts/Supplemental/Arial.ttf",
+        "/System/Library/Fonts/Helvetica.ttc"
+    ]
+else:
+    SYSTEM_FONTS = [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
+    ]
+
+# 常用EXIF标签ID，直接按数值查找
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_IFD_POINTER = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+
+# 支持的图片格式（小写扩展名）
+SUPPORTED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.heic', '.heif'}
+
+def _read_exif(image):
+    """
+    读取图片的EXIF数据（每张图片只解析一次）
+    
+    Args:
+        image (PIL.Image): 已打开的图片对象
+    
+    Returns:
+        dict: 合并了Exif子IFD的EXIF字典，键为标签ID
+    """
+    try:
+        # getexif() 对JPEG/HEIC等格式统一从 info['exif'] 解析，并带缓存
+        exif = image.getexif()
+        exif_data = dict(exif)
+        # DateTimeOriginal 等拍摄信息位于Exif子IFD
+        exif_data.update(exif.get_ifd(EXIF_IFD_POINTER))
+        return exif_data
+    except Exception as e:
+        print(f"EXIF解析失败: {e}")
+        # 尝试手动解析DateTimeOriginal
+        exif_bytes = image.info.get('exif', b'')
+        if exif_bytes:
+            try:
+                exif_str = exif_bytes.decode('utf-8', errors='ignore')
+                # 搜索DateTimeOriginal模式
+                match = re.search(r'(\d{4}:\d{2}:\d{2} \d{2}:\d{2}:\d{2})', exif_str)
+                if match:
+                    return {EXIF_DATETIME_ORIGINAL: match.group(1)}
+            except:
+                pass
+    return {}
+
+
+def _extract_taken_time(exif_data, image_path):
     """
     获取照片的拍摄时间
     优先从EXIF数据中获取DateTimeOriginal，如果没有则使用文件修改时间
+    
+    Args:
+        exif_data (dict): 由 _read_exif 解析得到的EXIF字典
+        image_path (str): 图片路径（用于日志及回退到文件修改时间）
+    
+    Returns:
+        datetime: 拍摄时间
     """
     try:
-        image = Image.open(image_path)
-        
-        # 尝试获取EXIF数据
-        exif_data = None
-        
-        # 方法1: 标准EXIF获取
-        if hasattr(image, '_getexif'):
-            exif_data = image._getexif()
-        # 方法2: 从info中获取EXIF（适用于HEIC等格式）
-        if not exif_data and hasattr(image, 'info') and 'exif' in image.info:
-            exif_bytes = image.info['exif']
-            if exif_bytes:
+        # 优先查找DateTimeOriginal（拍摄时间），其次DateTime（修改时间）
+        for tag, tag_name in ((EXIF_DATETIME_ORIGINAL, 'DateTimeOriginal'), (EXIF_DATETIME, 'DateTime')):
+            value = exif_data.get(tag)
+            if value and str(value).strip():
                 try:
-                    # 使用PIL的Exif类解析
-                    exif_obj = Image.Exif()
-                    exif_obj.load(exif_bytes)
-                    exif_data = {}
-                    for tag_id, value in exif_obj.items():
-                        tag_name = TAGS.get(tag_id, tag_id)
-                        exif_data[tag_name] = value
-                except Exception as e:
-                    print(f"EXIF解析失败: {e}")
-                    # 尝试手动解析DateTimeOriginal
-                    try:
-                        exif_str = exif_bytes.decode('utf-8', errors='ignore')
-                        # 搜索DateTimeOriginal模式
-                        import re
-                        match = re.search(r'(\d{4}:\d{2}:\d{2} \d{2}:\d{2}:\d{2})', exif_str)
-                        if match:
-                            return datetime.strptime(match.group(1), '%Y:%m:%d %H:%M:%S')
-                    except:
-                        pass
-        
-        # 解析EXIF数据获取拍摄时间
-        if exif_data:
-            # 优先查找DateTimeOriginal（拍摄时间）
-            for tag, value in exif_data.items():
-                if tag == 'DateTimeOriginal' or (isinstance(tag, int) and TAGS.get(tag) == 'DateTimeOriginal'):
-                    if value and str(value).strip():
-                        try:
-                            print(f"EXIF DateTimeOriginal: {os.path.basename(image_path)} {datetime.strptime(str(value).strip(), '%Y:%m:%d %H:%M:%S')}")
-                            return datetime.strptime(str(value).strip(), '%Y:%m:%d %H:%M:%S')
-                        except ValueError:
-                            continue
-            
-            # 如果没有DateTimeOriginal，尝试DateTime（修改时间）
-            for tag, value in exif_data.items():
-                if tag == 'DateTime' or (isinstance(tag, int) and TAGS.get(tag) == 'DateTime'):
-                    if value and str(value).strip():
-                        try:
-                            print(f"EXIF DateTime: {os.path.basename(image_path)} {datetime.strptime(str(value).strip(), '%Y:%m:%d %H:%M:%S')}")
-                            return datetime.strptime(str(value).strip(), '%Y:%m:%d %H:%M:%S')
-                        except ValueError:
-                            continue
+                    taken_time = datetime.strptime(str(value).strip(), '%Y:%m:%d %H:%M:%S')
+                    print(f"EXIF {tag_name}: {os.path.basename(image_path)} {taken_time}")
+                    return taken_time
+                except ValueError:
+                    continue
     
     except Exception as e:
         print(f"读取EXIF数据失败: {e}")
@@ -117,38 +150,50 @@ def add_watermark(image_path, output_path, font_path=None):
             original_format = image.format
             original_info = image.info.copy()
             original_exif = original_info.get('exif', b'')
+            # 转正会生成新图片对象，需提前记录JPEG编码参数
+            jpeg_settings = _get_jpeg_settings(image)
+            
+            # 只解析一次EXIF，供拍摄时间与方向共用
+            exif_data = _read_exif(image)
             
             # 获取EXIF方向标签
-            orientation = _get_exif_orientation(image)
+            orientation = exif_data.get(EXIF_ORIENTATION, 1)
 
             # 获取拍摄时间和水印文本
-            taken_time = get_photo_taken_time(image_path)
-            watermark_text = taken_time.strftime('%Y-%m-%d %H:%M')
+            taken_time = _extract_taken_time(exif_data, image_path)
+            watermark_text = taken_time.isoformat(sep=' ', timespec='minutes')  # YYYY-MM-DD HH:MM
             
-            # 根据方向标签调整图片方向以便添加水印
-            adjusted_image, rotation_info = _adjust_image_for_watermark(image, orientation)
+            # 按EXIF方向标签一次性将像素转正，直接在转正后的图片上绘制水印
+            # 无需旋转时跳过，exif_transpose 在这种情况下仍会完整复制一份像素
+            if orientation in range(2, 9):
+                image = ImageOps.exif_transpose(image)
+                # 像素已转正，重置方向标签，避免查看器再次旋转
+                original_exif = _reset_exif_orientation(original_exif)
             
-            # 获取调整后的图片尺寸
-            adj_width, adj_height = adjusted_image.size
+            # 获取图片尺寸
+            img_width, img_height = image.size
             
             # 计算字体大小
-            font_size = _calculate_optimal_font_size(watermark_text, adj_width, adj_height)
+            font_size = _calculate_optimal_font_size(len(watermark_text), img_width, img_height)
             
             # 加载字体
             font = _load_font(font_path, font_size)
             
-            # 计算水印位置（基于调整后的图片）
-            position = _calculate_watermark_position(adjusted_image, watermark_text, font)
+            # 整张图片只创建一个绘图对象
+            draw = ImageDraw.Draw(image)
             
-            # 添加水印（带阴影和加粗效果）
-            draw = ImageDraw.Draw(adjusted_image)
-            _add_text_with_shadow(draw, position, watermark_text, font)
-            
-            # 恢复原始方向
-            final_image = _restore_original_orientation(adjusted_image, rotation_info)
+            # 文字只光栅化一次，位置计算和多次绘制都复用同一个蒙版
+            mask, offset = _render_text_mask(font, watermark_text, draw.fontmode)
+            if mask is not None:
+                # 计算水印位置
+                position = _calculate_watermark_position(image.size, mask)
+                
+                # 添加水印（带阴影和加粗效果）
+                _add_text_with_shadow(draw, position, mask, offset)
             
             # 保存图片，保留所有原始信息
-            _save_image_with_metadata(final_image, output_path, original_format, original_info, original_exif)
+            _save_image_with_metadata(image, output_path, original_format, original_info, original_exif,
+                                      jpeg_settings)
             
             print(f"✓ 已处理: {os.path.basename(image_path)} -> {watermark_text} (字体大小: {font_size}px, 方向: {orientation})")
             return True
@@ -158,12 +203,14 @@ def add_watermark(image_path, output_path, font_path=None):
         return False
 
 
-def _calculate_optimal_font_size(text, img_width, img_height):
+@functools.lru_cache(maxsize=128)
+def _calculate_optimal_font_size(text_length, img_width, img_height):
     """
     计算最优字体大小，使文字面积约占图片面积的3%
+    结果只取决于文本长度和图片尺寸，同一相机拍摄的照片可直接命中缓存
     
     Args:
-        text (str): 水印文本
+        text_length (int): 水印文本长度
         img_width (int): 图片宽度
         img_height (int): 图片高度
     
@@ -177,7 +224,7 @@ def _calculate_optimal_font_size(text, img_width, img_height):
     char_width_ratio = 0.6  # 字符平均宽高比
     text_density_factor = 2  # 文字密度因子
     
-    font_size = int((target_text_area / (len(text) * char_width_ratio * text_density_factor)) ** 0.5)
+    font_size = int((target_text_area / (text_length * char_width_ratio * text_density_factor)) ** 0.5)
     
     # 限制字体大小在合理范围内
     min_font_size = 20
@@ -186,16 +233,16 @@ def _calculate_optimal_font_size(text, img_width, img_height):
     return max(min_font_size, min(font_size, max_font_size))
 
 
-def _load_font(font_path, font_size):
+@functools.lru_cache(maxsize=None)
+def _resolve_font_path(font_path):
     """
-    加载字体，支持多种回退选项
+    按优先级查找第一个可用的字体文件，结果会被缓存，避免每张图片重复探测
     
     Args:
         font_path (str): 字体文件路径
-        font_size (int): 字体大小
     
     Returns:
-        ImageFont.FreeTypeFont: 加载的字体对象
+        str: 可用的字体路径，均不可用时返回None
     """
     # 字体优先级列表
     font_candidates = []
@@ -203,48 +250,56 @@ def _load_font(font_path, font_size):
     if font_path and os.path.exists(font_path):
         font_candidates.append(font_path)
     
-    # 常见系统字体
-    system_fonts = [
-        "arial.ttf",
-        "times.ttf", 
-        "calibri.ttf",
-        "verdana.ttf",
-        "tahoma.ttf"
-    ]
-    
-    font_candidates.extend(system_fonts)
+    font_candidates.extend(SYSTEM_FONTS)
     
     # 尝试加载字体
     for font_candidate in font_candidates:
         try:
-            print(f"尝试加载字体: {font_candidate}, 大小: {font_size}")
-            return ImageFont.truetype(font_candidate, font_size)
+            print(f"尝试加载字体: {font_candidate}")
+            ImageFont.truetype(font_candidate, 10)
+            return font_candidate
         except (IOError, OSError):
             continue
     
+    print("警告: 未找到可用的系统字体，水印将使用很小的默认字体，建议通过 --font 指定字体文件")
+    return None
+
+
+@functools.lru_cache(maxsize=64)
+def _load_font(font_path, font_size):
+    """
+    加载字体，支持多种回退选项
+    相同路径和大小的字体对象会被缓存复用
+    
+    Args:
+        font_path (str): 字体文件路径
+        font_size (int): 字体大小
+    
+    Returns:
+        ImageFont.FreeTypeFont: 加载的字体对象
+    """
+    resolved_path = _resolve_font_path(font_path)
+    if resolved_path:
+        return ImageFont.truetype(resolved_path, font_size)
+    
     # 最后回退到默认字体
-    print("回退到默认字体")
     return ImageFont.load_default()
 
-def _calculate_watermark_position(image, text, font):
+def _calculate_watermark_position(image_size, text_mask):
     """
     计算水印位置（右下角）
     
     Args:
-        image (PIL.Image): 图片对象
-        text (str): 水印文本
-        font (ImageFont.FreeTypeFont): 字体对象
+        image_size (tuple): 图片尺寸 (宽度, 高度)
+        text_mask (PIL.Image): 由 _render_text_mask 生成的文字蒙版
     
     Returns:
         tuple: (x, y) 坐标
     """
-    draw = ImageDraw.Draw(image)
-    img_width, img_height = image.size
+    img_width, img_height = image_size
     
-    # 计算文字尺寸
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
+    # 文字蒙版的范围与 textbbox 一致
+    text_width, text_height = text_mask.size
     
     # 计算边距（根据图片大小自适应）
     margin = max(20, min(img_width, img_height) // 50)
@@ -256,124 +311,105 @@ def _calculate_watermark_position(image, text, font):
     return (x, y)
 
 
-def _get_exif_orientation(image):
+def _reset_exif_orientation(exif_bytes):
     """
-    获取图片的EXIF方向标签
+    将EXIF中的方向标签重置为1（正常方向）
     
     Args:
-        image (PIL.Image): 图片对象
+        exif_bytes (bytes): 原始EXIF数据
     
     Returns:
-        int: 方向标签值 (1-8)
+        bytes: 重置方向标签后的EXIF数据
     """
-    try:
-        # 尝试不同的方法获取EXIF数据
-        if hasattr(image, '_getexif'):
-            exif_data = image._getexif()
-        elif hasattr(image, 'info') and 'exif' in image.info:
-            exif_bytes = image.info['exif']
-            try:
-                # 简单解析，寻找方向标签
-                import struct
-                if len(exif_bytes) > 10:
-                    # 搜索方向标签 (0x0112)
-                    for i in range(0, len(exif_bytes) - 10, 12):
-                        if exif_bytes[i:i+2] == b'\x11\x02':  # Orientation tag little endian
-                            orientation = struct.unpack('<H', exif_bytes[i+8:i+10])[0]
-                            return orientation
-                        elif exif_bytes[i:i+2] == b'\x02\x11':  # Orientation tag big endian
-                            orientation = struct.unpack('>H', exif_bytes[i+8:i+10])[0]
-                            return orientation
-            except:
-                pass
-            exif_data = None
-        else:
-            exif_data = None
-        
-        if exif_data:
-            for tag, value in exif_data.items():
-                if TAGS.get(tag) == 'Orientation':
-                    return value
-    except Exception:
-        pass
+    if not exif_bytes:
+        return exif_bytes
     
-    return 1  # 默认方向
+    exif = Image.Exif()
+    exif.load(exif_bytes)
+    exif[EXIF_ORIENTATION] = 1
+    return exif.tobytes()
 
 
-def _adjust_image_for_watermark(image, orientation):
+@functools.lru_cache(maxsize=256)
+def _render_glyph(font, char):
     """
-    根据EXIF方向标签调整图片方向，以便正确添加水印
+    渲染单个字符的灰度蒙版，同一字体下每个字符只光栅化一次
     
     Args:
-        image (PIL.Image): 原始图片对象
-        orientation (int): EXIF方向标签
+        font (ImageFont.FreeTypeFont): 字体对象
+        char (str): 单个字符
     
     Returns:
-        tuple: (调整后的图片, 旋转信息)
+        tuple: (字符蒙版，空白字符为None, 左侧偏移, 顶部偏移, 步进宽度)
     """
-    rotation_info = {
-        'rotated': False,
-        'angle': 0,
-        'orientation': orientation
-    }
-    
-    adjusted_image = image.copy()
-    
-    if orientation == 3:
-        # 180度旋转
-        adjusted_image = adjusted_image.rotate(180, expand=True)
-        rotation_info['rotated'] = True
-        rotation_info['angle'] = 180
-    elif orientation == 6:
-        # 顺时针旋转90度
-        adjusted_image = adjusted_image.rotate(-90, expand=True)
-        rotation_info['rotated'] = True
-        rotation_info['angle'] = -90
-    elif orientation == 8:
-        # 逆时针旋转90度
-        adjusted_image = adjusted_image.rotate(90, expand=True)
-        rotation_info['rotated'] = True
-        rotation_info['angle'] = 90
-    
-    return adjusted_image, rotation_info
+    left, top, right, bottom = font.getbbox(char)
+    advance = font.getlength(char)
+    if right <= left or bottom <= top:
+        return None, 0, 0, advance
+    
+    glyph = Image.new('L', (right - left, bottom - top))
+    ImageDraw.Draw(glyph).text((-left, -top), char, font=font, fill=255)
+    return glyph, left, top, advance
 
 
-def _restore_original_orientation(image, rotation_info):
+def _render_text_mask(font, text, fontmode):
     """
-    恢复图片的原始方向
+    生成整段文字的蒙版，蒙版范围与 textbbox 一致
+    抗锯齿模式下用缓存的字符蒙版拼接，避免每次绘制都重新光栅化
     
     Args:
-        image (PIL.Image): 已添加水印的图片
-        rotation_info (dict): 旋转信息
+        font (ImageFont.FreeTypeFont): 字体对象
+        text (str): 文字内容
+        fontmode (str): 目标绘图对象的字体模式（'L' 抗锯齿，'1' 二值）
     
     Returns:
-        PIL.Image: 恢复方向后的图片
+        tuple: (文字蒙版，无可见字符时为None, 相对文字位置的偏移 (x, y))
     """
-    if not rotation_info['rotated']:
-        return image
-    
-    # 恢复到原始方向
-    if rotation_info['angle'] == 180:
-        return image.rotate(180, expand=True)
-    elif rotation_info['angle'] == -90:
-        return image.rotate(90, expand=True)
-    elif rotation_info['angle'] == 90:
-        return image.rotate(-90, expand=True)
-    
-    return image
+    if fontmode != 'L' or not isinstance(font, ImageFont.FreeTypeFont):
+        # 二值模式（P/1/I/F图片）下逐字拼接与整段排版的像素不一致，
+        # 位图默认字体也没有可拼接的字符度量，这两种情况整段绘制一次
+        left, top, right, bottom = ImageDraw.Draw(Image.new(fontmode, (1, 1))).textbbox(
+            (0, 0), text, font=font)
+        if right <= left or bottom <= top:
+            return None, (0, 0)
+        mask = Image.new(fontmode, (right - left, bottom - top))
+        ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+        return mask, (left, top)
+    
+    placements = []
+    cursor = 0
+    for char in text:
+        glyph, left, top, advance = _render_glyph(font, char)
+        if glyph is not None:
+            placements.append((glyph, int(round(cursor)) + left, top))
+        cursor += advance
+    
+    if not placements:
+        return None, (0, 0)
+    
+    min_x = min(x for _, x, _ in placements)
+    min_y = min(y for _, _, y in placements)
+    width = max(x + glyph.width for glyph, x, _ in placements) - min_x
+    height = max(y + glyph.height for glyph, _, y in placements) - min_y
+    
+    mask = Image.new('L', (width, height))
+    for glyph, x, y in placements:
+        mask.paste(255, (x - min_x, y - min_y), glyph)
+    return mask, (min_x, min_y)
 
 
-def _add_text_with_shadow(draw, position, text, font):
+def _add_text_with_shadow(draw, position, mask, offset):
     """
     为文字添加阴影和加粗效果
     
     Args:
         draw (ImageDraw.Draw): 绘图对象
         position (tuple): 文字位置 (x, y)
-        text (str): 文字内容
-        font (ImageFont.FreeTypeFont): 字体对象
+        mask (PIL.Image): 由 _render_text_mask 生成的文字蒙版
+        offset (tuple): 蒙版相对文字位置的偏移 (x, y)
     """
-    x, y = position
+    x = position[0] + offset[0]
+    y = position[1] + offset[1]
     
     # 阴影参数
     shadow_offset = 3  # 阴影偏移量
@@ -385,55 +421,41 @@ def _add_text_with_shadow(draw, position, text, font):
     # 绘制阴影（稍微偏移）
     shadow_x = x + shadow_offset
     shadow_y = y + shadow_offset
-    draw.text((shadow_x, shadow_y), text, font=font, fill=shadow_color)
+    draw.bitmap((shadow_x, shadow_y), mask, fill=shadow_color)
     
     # 绘制加粗效果（通过多次绘制实现）
     for dx in range(-bold_offset, bold_offset + 1):
         for dy in range(-bold_offset, bold_offset + 1):
             if dx == 0 and dy == 0:
                 continue  # 跳过中心位置，留给主文字
-            draw.text((x + dx, y + dy), text, font=font, fill="#ECAE35")
+            draw.bitmap((x + dx, y + dy), mask, fill="#ECAE35")
     
     # 绘制主文字（金色）
-    draw.text((x, y), text, font=font, fill="#ECAE35")
+    draw.bitmap((x, y), mask, fill="#ECAE35")
+
 
-def _add_text_with_border(draw, position, text, font):
+def _get_jpeg_settings(image):
     """
-    为文字添加黑边和阴影效果
+    获取原始JPEG的量化表和色度子采样设置
     
     Args:
-        draw (ImageDraw.Draw): 绘图对象
-        position (tuple): 文字位置 (x, y)
-        text (str): 文字内容
-        font (ImageFont.FreeTypeFont): 字体对象
-    """
-    x, y = position
-    
-    # 黑边参数
-    border_offset = 1  # 黑边偏移量
-    border_color = "#000000"  # 黑色边框
+        image (PIL.Image): 刚打开的图片对象
     
-    # 阴影参数
-    shadow_offset = 3  # 阴影偏移量
-    shadow_color = "#000000"  # 黑色阴影
-    
-    # # 绘制阴影（稍微偏移）
-    # shadow_x = x + shadow_offset
-    # shadow_y = y + shadow_offset
-    # draw.text((shadow_x, shadow_y), text, font=font, fill=shadow_color)
-    
-    # 绘制黑边效果（通过多次绘制实现）
-    for dx in range(-border_offset, border_offset + 1):
-        for dy in range(-border_offset, border_offset + 1):
-            if dx == 0 and dy == 0:
-                continue  # 跳过中心位置，留给主文字
-            draw.text((x + dx, y + dy), text, font=font, fill=border_color)
+    Returns:
+        dict: 可直接传给 image.save 的JPEG参数，非JPEG图片返回空字典
+    """
+    # 带多图预览的JPEG会被识别为MPO，MpoImageFile 同样是 JpegImageFile 的子类
+    if not isinstance(image, JpegImagePlugin.JpegImageFile):
+        return {}
     
-    # 绘制主文字（橙色）
-    draw.text((x, y), text, font=font, fill="#ECAE35")
+    return {
+        'qtables': image.quantization,
+        'subsampling': JpegImagePlugin.get_sampling(image),
+    }
 
 
-def _save_image_with_metadata(image, output_path, original_format, original_info, original_exif):
+def _save_image_with_metadata(image, output_path, original_format, original_info, original_exif,
+                              jpeg_settings=None):
     """
     保存图片，保留所有原始元数据
     
@@ -443,6 +465,7 @@ def _save_image_with_metadata(image, output_path, original_format, original_info
         original_format (str): 原始格式
         original_info (dict): 原始信息字典
         original_exif (bytes): 原始EXIF数据
+        jpeg_settings (dict, optional): 原始JPEG的量化表和子采样设置
     """
     # 根据文件扩展名推断格式
     ext = os.path.splitext(output_path)[1].lower()
@@ -488,16 +511,40 @@ def _save_image_with_metadata(image, output_path, original_format, original_info
         }
         save_kwargs['format'] = format_map.get(ext, 'JPEG')
     
+    # JPEG沿用原图的量化表和子采样，避免按默认质量75重新压缩造成画质损失
+    if save_kwargs['format'] in ('JPEG', 'MPO') and jpeg_settings:
+        save_kwargs.update(jpeg_settings)
+    
     # 保存图片
     image.save(output_path, **save_kwargs)
 
-def process_folder(input_folder, font_path=None):
+def _worker(task):
     """
-    处理文件夹中的所有照片
+    进程池任务入口（需定义在模块级别以便序列化）
+    处理过程中的输出先写入缓冲区，由主进程统一打印，避免多个进程争用标准输出
+    
+    Args:
+        task (tuple): (输入图片路径, 输出图片路径, 字体文件路径)
+    
+    Returns:
+        tuple: (处理是否成功, 处理过程中的输出文本)
+    """
+    input_path, output_path, font_path = task
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        ok = add_watermark(input_path, output_path, font_path)
+    return ok, buffer.getvalue()
+
+
+def process_folder(input_folder, font_path=None, use_threads=False):
     """
-    # 支持的图片格式
-    supported_formats = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.heic', '.heif')
+    处理文件夹中的所有照片
     
+    Args:
+        input_folder (str): 输入文件夹路径
+        font_path (str, optional): 字体文件路径
+        use_threads (bool): 使用线程池代替进程池（PIL编解码时会释放GIL）
+    """
     # 检查HEIC支持
     if not HEIC_SUPPORTED:
         print("注意: HEIC/HEIF格式支持不可用，请安装pillow-heif库")
@@ -512,18 +559,35 @@ def process_folder(input_folder, font_path=None):
     print(f"输出文件夹: {output_folder}")
     print("-" * 50)
     
-    processed_count = 0
-    total_count = 0
+    # 收集待处理的文件
+    with os.scandir(input_folder) as it:
+        entries = [
+            entry for entry in it
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS
+        ]
+    entries.sort(key=lambda entry: entry.name)
+    
+    tasks = [
+        (entry.path, os.path.join(output_folder, f"watermarked_{entry.name}"), font_path)
+        for entry in entries
+    ]
     
-    # 遍历文件夹中的所有文件
-    for filename in os.listdir(input_folder):
-        if filename.lower().endswith(supported_formats):
-            total_count += 1
-            input_path = os.path.join(input_folder, filename)
-            output_path = os.path.join(output_folder, f"watermarked_{filename}")
-            
-            if add_watermark(input_path, output_path, font_path):
-                processed_count += 1
+    total_count = len(tasks)
+    
+    # 每张图片相互独立，并行处理
+    if use_threads:
+        # 线程共享同一个 sys.stdout，无法分别重定向，直接输出
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = list(executor.map(lambda task: add_watermark(*task), tasks))
+    else:
+        # 子进程的输出由主进程按文件顺序统一打印
+        results = []
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for ok, output in executor.map(_worker, tasks, chunksize=4):
+                sys.stdout.write(output)
+                results.append(ok)
+    
+    processed_count = sum(1 for ok in results if ok)
     
     print("-" * 50)
     print(f"处理完成！共处理 {processed_count} 张照片，总计 {total_count} 张图片文件")
@@ -532,6 +596,7 @@ def main():
     parser = argparse.ArgumentParser(description='为照片批量添加拍摄时间水印')
     parser.add_argument('input_folder', help='包含照片的输入文件夹路径')
     parser.add_argument('--font', help='字体文件路径（DBLCDTempBlack字体）')
+    parser.add_argument('--threads', action='store_true', help='使用多线程代替多进程并行处理')
     
     args = parser.parse_args()
     
@@ -546,7 +611,7 @@ def main():
         sys.exit(1)
     
     # 处理文件夹
-    process_folder(args.input_folder, args.font)
+    process_folder(args.input_folder, args.font, args.threads)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file